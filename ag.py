@@ -38,6 +38,8 @@ import json        # JSON 数据处理，用于解析 LLM 返回的参数
 import time        # 时间相关功能，用于计时和延迟
 import inspect     # 检查对象，用于判断函数是否为异步函数
 import asyncio     # 异步 I/O，用于运行异步主循环
+import weakref     # 弱引用，用于按参数模型类缓存 Schema
+import threading   # 线程锁，保护在线程池中执行的会话持久化
 
 # =============================================================================
 # 第三方库导入
@@ -47,7 +49,7 @@ from pathlib import Path  # 面向对象的文件路径处理，比 os.path 更
 from dotenv import load_dotenv  # 从 .env 文件加载环境变量
 from pydantic import BaseModel, Field  # 数据验证和设置管理
 # typing 模块提供类型提示支持，让代码更清晰、IDE 支持更好
-from typing import Dict, Any, Callable, Type, List, Generator, Union
+from typing import Dict, Any, Callable, Type, List, Generator, Union, Optional
 # OpenAI 官方 SDK，用于调用 LLM API
 from openai import AsyncOpenAI, DefaultHttpxClient
 import httpx  # 现代化的 HTTP 客户端库
@@ -111,6 +113,12 @@ from agent_tools.mcp.transport import StdioTransport, SseTransport
 # 这一层负责与大语言模型 API 进行通信，处理请求发送和响应接收
 # =============================================================================
 
+# 参数模型 -> 清理后的 JSON Schema 缓存
+# model_json_schema() 对同一个模型的结果是确定的，每个模型只需反射一次；
+# 使用弱引用，模型类被回收时缓存项自动消失
+_PARAMETERS_SCHEMA_CACHE: "weakref.WeakKeyDictionary[Type[BaseModel], dict]" = weakref.WeakKeyDictionary()
+
+
 def generate_openai_schema(func: Callable, args_model: Type[BaseModel]) -> dict:
     """
     自动将函数和 Pydantic 参数模型转换为 OpenAI Function Calling 要求的 Schema 格式。
@@ -142,14 +150,19 @@ def generate_openai_schema(func: Callable, args_model: Type[BaseModel]) -> dict:
             }
         }
     """
-    # 步骤 1: 使用 Pydantic 的 model_json_schema() 方法生成原生 JSON Schema
-    # 这会自动包含所有字段的类型、描述、必填项等信息
-    raw_schema = args_model.model_json_schema()
-    
-    # 步骤 2: 清理 Pydantic 特有的字段
-    # OpenAI API 不需要 'title' 字段，移除它可以减少 token 消耗
-    if "title" in raw_schema:
-        del raw_schema["title"]
+    raw_schema = _PARAMETERS_SCHEMA_CACHE.get(args_model)
+    if raw_schema is None:
+        # 步骤 1: 使用 Pydantic 的 model_json_schema() 方法生成原生 JSON Schema
+        # 这会自动包含所有字段的类型、描述、必填项等信息
+        raw_schema = args_model.model_json_schema()
+        
+        # 步骤 2: 清理 Pydantic 特有的字段
+        # OpenAI API 不需要 'title' 字段，移除它可以减少 token 消耗
+        if "title" in raw_schema:
+            del raw_schema["title"]
+        
+        # 缓存结果（各工具定义共享同一个 parameters 字典，视为只读）
+        _PARAMETERS_SCHEMA_CACHE[args_model] = raw_schema
     
     # 步骤 3: 组装成 OpenAI Function Calling 格式
     # 这个格式是 OpenAI API 要求的标准结构
@@ -310,6 +323,20 @@ class ContextManager:
         self.logger = logger
         self.autosave_file = autosave_file
         
+        # 历史变更回调：设置后替代同步自动保存
+        # Web 端用它通知后台的防抖保存任务，而不是每条消息都重写整个文件
+        self.on_change: Optional[Callable[[], None]] = None
+        
+        # 已持久化的消息数量（快照 + 追加日志）
+        # 0 表示尚未持久化或历史被重写，下次保存需要写完整快照
+        self._persisted_len = 0
+        
+        # 持久化锁：保存/加载通常在线程池中执行（asyncio.to_thread），
+        # _persisted_len 的读取-写盘-更新以及日志的删除/重写必须互斥，
+        # 否则两个并发保存会把同一批消息重复追加到日志中
+        # 使用可重入锁，因为 append_history 在压缩时会调用 save_history
+        self._persist_lock = threading.RLock()
+        
         # 构建系统提示词
         # 系统提示词定义了 AI 的行为方式和可用能力
         system_prompt = self._build_system_prompt(workspace)
@@ -342,9 +369,8 @@ class ContextManager:
         # 添加到历史记录
         self.history.append(user_msg)
         
-        # 自动保存到文件
-        if self.autosave_file:
-            self.save_history(self.autosave_file)
+        # 自动保存（或通知防抖保存任务）
+        self._autosave()
 
     def add_assistant_msg(self, message: Any):
         """
@@ -367,9 +393,8 @@ class ContextManager:
         # 添加到历史记录
         self.history.append(message)
         
-        # 自动保存
-        if self.autosave_file:
-            self.save_history(self.autosave_file)
+        # 自动保存（或通知防抖保存任务）
+        self._autosave()
 
     def add_tool_output(self, tool_call_id: str, content: str):
         """
@@ -400,9 +425,34 @@ class ContextManager:
         # 添加到历史记录
         self.history.append(tool_output)
         
-        # 自动保存
-        if self.autosave_file:
-            self.save_history(self.autosave_file)
+        # 自动保存（或通知防抖保存任务）
+        self._autosave()
+
+    def _autosave(self):
+        """
+        历史变更后的自动保存。
+        
+        如果设置了 on_change 回调，只通知回调（由调用方决定何时写盘）；
+        否则在配置了 autosave_file 时立即同步（增量）保存。
+        """
+        if self.on_change is not None:
+            self.on_change()
+        elif self.autosave_file:
+            self.append_history(self.autosave_file)
+
+    # 追加日志首行的键，记录日志第一条消息在历史中的序号
+    JOURNAL_BASE_KEY = "_journal_base"
+
+    @staticmethod
+    def journal_path(filepath: str) -> str:
+        """
+        获取快照文件对应的追加日志路径。
+        
+        示例:
+            >>> ContextManager.journal_path("sessions/1_session_x.json")
+            'sessions/1_session_x.jsonl'
+        """
+        return str(Path(filepath).with_suffix(".jsonl"))
 
     def save_history(self, filepath: str):
         """
@@ -414,11 +464,66 @@ class ContextManager:
         用途:
         - 会话持久化，下次可以继续对话
         - 调试和分析对话流程
+        
+        注意:
+            - 先写临时文件再 os.replace，快照要么是旧的要么是新的，不会写坏
+            - 快照替换后才删除追加日志；若删除失败（进程中断、Windows 文件占用），
+              残留日志中已包含在快照里的消息会在加载时按序号跳过
+        """
+        with self._persist_lock:
+            tmp_path = f"{filepath}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                # ensure_ascii=False 支持中文等非 ASCII 字符
+                # indent=2 使 JSON 文件可读性更好
+                json.dump(self.history, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, filepath)
+        
+            # 快照已包含全部消息，清除追加日志
+            journal = self.journal_path(filepath)
+            if os.path.exists(journal):
+                os.remove(journal)
+            self._persisted_len = len(self.history)
+
+    def append_history(self, filepath: str, compact_ratio: int = 4):
+        """
+        增量保存对话历史。
+        
+        只把上次保存之后新增的消息逐行追加到 JSONL 日志（filepath 同名 .jsonl），
+        每轮写入量与新消息大小成正比，而不是与整个历史成正比。
+        
+        参数:
+            filepath (str): 快照文件路径
+            compact_ratio (int): 日志大小超过快照的多少倍时压缩为新快照
+        
+        注意:
+            - 尚未保存过或历史被重写（如 reset）时，直接写完整快照
+            - 压缩即调用 save_history 重写快照并清除日志，摊还后仍是 O(新消息)
         """
-        with open(filepath, 'w', encoding='utf-8') as f:
-            # ensure_ascii=False 支持中文等非 ASCII 字符
-            # indent=2 使 JSON 文件可读性更好
-            json.dump(self.history, f, ensure_ascii=False, indent=2)
+        with self._persist_lock:
+            start = self._persisted_len
+            if start == 0 or start > len(self.history) or not os.path.exists(filepath):
+                self.save_history(filepath)
+                return
+        
+            new_messages = self.history[start:]
+            if not new_messages:
+                return
+        
+            with open(self.journal_path(filepath), 'ab') as f:
+                # 新日志的第一行记录首条消息在历史中的序号，加载时据此与快照对齐
+                if f.tell() == 0:
+                    f.write(json.dumps({self.JOURNAL_BASE_KEY: start}).encode('utf-8') + b"\n")
+                for message in new_messages:
+                    f.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b"\n")
+                journal_size = f.tell()
+            self._persisted_len = len(self.history)
+        
+            # 更新快照的修改时间，会话列表按它排序
+            os.utime(filepath)
+        
+            # 日志过大时压缩为新快照
+            if journal_size > compact_ratio * os.path.getsize(filepath):
+                self.save_history(filepath)
 
     def load_history(self, filepath: str):
         """
@@ -432,24 +537,71 @@ class ContextManager:
             - 只加载用户、助手、工具消息
             - 这样可以更新系统提示词而不影响历史对话
         """
-        with open(filepath, 'r', encoding='utf-8') as f:
-            loaded_history = json.load(f)
-        
-        # 如果加载的历史为空，直接返回
-        if not loaded_history:
-            return
-
-        # 保留当前的系统提示词（self.history[0]）
-        # 用加载的历史替换其余部分
-        current_system = self.history[0]
-        
-        # 检查加载的历史是否有系统提示词（跳过它）
-        start_idx = 0
-        if loaded_history[0].get("role") == "system":
-            start_idx = 1
+        with self._persist_lock:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                loaded_history = json.load(f)
+        
+            # 追加日志中是快照之后新增的消息
+            # 快照的消息数即其列表长度；日志中序号小于它的行已包含在快照里，跳过
+            snapshot_len = len(loaded_history)
+            stale = False
+            journal = self.journal_path(filepath)
+            if os.path.exists(journal):
+                good_end = 0
+                torn = False
+                with open(journal, 'rb') as f:
+                    pos = None
+                    for line in f:
+                        # 没有换行结尾的最后一行是中断写入的残片
+                        if not line.endswith(b"\n"):
+                            torn = True
+                            break
+                        if not line.strip():
+                            good_end += len(line)
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            torn = True
+                            break
+                        good_end += len(line)
+                        if pos is None:
+                            if isinstance(entry, dict) and self.JOURNAL_BASE_KEY in entry:
+                                pos = entry[self.JOURNAL_BASE_KEY]
+                                continue
+                            # 旧版日志没有序号行，紧接在快照之后
+                            pos = snapshot_len
+                        if pos < snapshot_len:
+                            stale = True
+                        elif pos == len(loaded_history):
+                            loaded_history.append(entry)
+                        else:
+                            # 日志与快照之间有缺口，之后的内容无法对齐
+                            stale = True
+                            break
+                        pos += 1
+                # 截掉残片，否则之后追加的第一条消息会与它拼成无法解析的一行，
+                # 导致其后的所有消息在下次加载时丢失
+                if torn:
+                    os.truncate(journal, good_end)
+        
+            # 如果加载的历史为空，直接返回
+            if not loaded_history:
+                return
+
+            # 保留当前的系统提示词（self.history[0]）
+            # 用加载的历史替换其余部分
+            current_system = self.history[0]
+        
+            # 检查加载的历史是否有系统提示词（跳过它）
+            start_idx = 0
+            if loaded_history[0].get("role") == "system":
+                start_idx = 1
             
-        # 组合：当前系统提示词 + 加载的历史（跳过其系统提示词）
-        self.history = [current_system] + loaded_history[start_idx:]
+            # 组合：当前系统提示词 + 加载的历史（跳过其系统提示词）
+            self.history = [current_system] + loaded_history[start_idx:]
+            # 日志与快照不一致时，下次保存写完整快照并清除日志
+            self._persisted_len = 0 if stale else len(self.history)
 
     def reset(self):
         """
@@ -461,13 +613,18 @@ class ContextManager:
         """
         workspace = os.getcwd()  # 重新获取工作目录
         
-        if self.history:
-            # 保留系统提示词（第一条消息）
-            self.history = [self.history[0]]
-        else:
-            # 如果历史为空（不应该发生），重新创建系统提示词
-            system_prompt = self._build_system_prompt(workspace)
-            self.history = [{"role": "system", "content": system_prompt}]
+        # 与正在进行的保存互斥，保证之后的保存看到的是重置后的状态
+        with self._persist_lock:
+            # 历史被重写，下次保存需要写完整快照
+            self._persisted_len = 0
+            
+            if self.history:
+                # 保留系统提示词（第一条消息）
+                self.history = [self.history[0]]
+            else:
+                # 如果历史为空（不应该发生），重新创建系统提示词
+                system_prompt = self._build_system_prompt(workspace)
+                self.history = [{"role": "system", "content": system_prompt}]
 
     def _build_system_prompt(self, workspace: str) -> str:
         """
@@ -757,6 +914,27 @@ class ToolExecutor:
         """
         return self._schemas
 
+    def clone(self) -> "ToolExecutor":
+        """
+        复制一个新的工具执行器。
+
+        浅拷贝执行表和 Schema 列表，工具函数和 Schema 字典本身是共享的。
+        这样可以从预先注册好的"原型"执行器快速派生出独立实例，
+        之后在副本上注册的工具（如 MCP 工具）不会影响原型。
+
+        返回:
+            ToolExecutor: 新的工具执行器实例
+
+        示例:
+            >>> executor = prototype.clone()
+            >>> executor.register_mcp_tool(tool, client)  # 不影响 prototype
+        """
+        # 走正常的 __init__，以后新增的属性也会被初始化
+        executor = ToolExecutor()
+        executor._execution_map = dict(self._execution_map)
+        executor._schemas = list(self._schemas)
+        return executor
+
     async def execute(self, name: str, raw_args: dict, ctx: ToolContext) -> Any:
         """
         执行指定的工具。
@@ -951,6 +1129,7 @@ class AgentRuntime:
         logger: 日志记录器
         max_steps (int): 最大循环次数，防止死循环
         tool_context (ToolContext): 工具执行上下文
+        mcp_clients (List): 该运行时持有的 MCP 客户端
     
     工作流程：
         用户输入 → 添加到上下文 → 发送到 LLM → 解析响应
@@ -985,6 +1164,9 @@ class AgentRuntime:
         self.logger = logger
         self.max_steps = 100  # 最大循环次数，防止死循环
         
+        # 该运行时持有的 MCP 客户端，保持引用以维持连接
+        self.mcp_clients: List[Any] = []
+        
         # 初始化工具上下文
         # 工具上下文包含执行工具所需的所有信息
         self.tool_context = ToolContext(
@@ -1401,8 +1583,6 @@ async def init_mcp_servers(runtime: AgentRuntime):
                     await client.connect()
                     
                     # Store client in runtime to keep it alive
-                    if not hasattr(runtime, "mcp_clients"):
-                        runtime.mcp_clients = []
                     runtime.mcp_clients.append(client)
                     
                     tools = await client.list_tools()
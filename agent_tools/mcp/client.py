@@ -79,6 +79,10 @@ class McpClient:
         """
         发送 JSON-RPC 请求并等待响应。
         """
+        # 接收循环已结束时响应永远不会到达，直接失败而不是永久等待
+        if self._receive_task is not None and self._receive_task.done():
+            raise ConnectionError("MCP connection closed")
+        
         request_id = self._get_next_id()
         future = asyncio.get_event_loop().create_future()
         self._pending_requests[request_id] = future
@@ -132,6 +136,14 @@ class McpClient:
         except Exception as e:
             print(f"[Error] MCP receive loop error: {e}")
             # TODO: 可以在这里触发重连或断开连接事件
+        finally:
+            # 接收循环结束（EOF、出错或被取消）即视为断开：
+            # 标记未连接，并让所有等待中的请求失败，避免永久挂起
+            self.is_connected = False
+            pending, self._pending_requests = self._pending_requests, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("MCP connection closed"))
 
     def _handle_message(self, message: Dict[str, Any]):
         """处理接收到的消息"""
@@ -30,7 +30,7 @@ ownAgent - 技���管理器模块
 # =============================================================================
 
 from pathlib import Path  # 面向对象的文件路径处理
-from typing import List, Optional  # 类型提示
+from typing import Dict, List, Optional, Set  # 类型提示
 import re  # 正则表达式，用于文本匹配
 
 # =============================================================================
@@ -61,6 +61,7 @@ class SkillsManager:
     属性:
         loader (SkillsLoader): 技能加载器实例
         skills (List[SkillMetadata]): 已加载的技能元信息列表
+        _tri_index (Dict[str, Set[int]]): 三元组倒排索引 {trigram: 技能下标集合}
     
     使用示例:
         >>> manager = SkillsManager(Path(".skills"))
@@ -69,7 +70,11 @@ class SkillsManager:
         >>> content = manager.get_skill_content("create_api")
     """
     
-    def __init__(self, skills_root: Path):
+    def __init__(
+        self,
+        skills_root: Path,
+        preloaded_metadata: Optional[List[SkillMetadata]] = None
+    ):
         """
         初始化技能管理器。
         
@@ -77,11 +82,18 @@ class SkillsManager:
             skills_root (Path): 技能根目录路径
                 - 默认为 .skills
                 - 会在初始化时创建加载器
+            
+            preloaded_metadata (Optional[List[SkillMetadata]]): 已加载的元信息
+                - 调用方已经执行过 load_all_metadata 时传入
+                - 传入后无需再调用 load_skills，避免重复遍历技能目录
         """
         # 创建技能加载器
         self.loader = SkillsLoader(skills_root)
         # 存储已加载的技能元信息
-        self.skills: List[SkillMetadata] = []
+        self.skills: List[SkillMetadata] = list(preloaded_metadata or [])
+        # 三元组倒排索引，用于搜索时快速筛选候选技能
+        self._tri_index: Dict[str, Set[int]] = {}
+        self._build_index()
     
     def load_skills(self) -> int:
         """
@@ -100,9 +112,56 @@ class SkillsManager:
         """
         # 加载所有元信息
         self.skills = self.loader.load_all_metadata()
+        # 重建搜索索引
+        self._build_index()
         # 返回加载数量
         return len(self.skills)
     
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        """返回文本中所有长度为 3 的子串（滑动窗口）。"""
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def _build_index(self) -> None:
+        """
+        构建三元组倒排索引。
+        
+        对每个技能的小写名称和描述做 3 字符滑动窗口，
+        记录 trigram -> 技能下标 的映射。
+        """
+        index: Dict[str, Set[int]] = {}
+        for i, skill in enumerate(self.skills):
+            text = f"{skill.name.lower()}\n{skill.description.lower()}"
+            for tri in self._trigrams(text):
+                index.setdefault(tri, set()).add(i)
+        self._tri_index = index
+    
+    def _candidate_indices(self, query_words: set) -> Optional[Set[int]]:
+        """
+        用三元组索引筛选可能匹配的技能下标。
+        
+        某个词能出现在名称或描述中，它的所有三元组必然都在索引里，
+        所以候选集 = 各个词的三元组倒排集合交集的并集。
+        候选只是超集，最终得分仍由 _calculate_relevance 精确计算。
+        
+        返回:
+            Optional[Set[int]]: 候选下标集合；
+                查询为空或含少于 3 个字符的词时无法用索引，返回 None（全量扫描）
+        """
+        if not query_words or any(len(word) < 3 for word in query_words):
+            return None
+        
+        candidates: Set[int] = set()
+        for word in query_words:
+            postings = [self._tri_index.get(tri) for tri in self._trigrams(word)]
+            if not all(postings):
+                # 有三元组不在任何技能中，这个词不会匹配
+                continue
+            # 从最小的集合开始求交集
+            postings.sort(key=len)
+            candidates |= set.intersection(*postings)
+        return candidates
+    
     def get_metadata_summary(self) -> str:
         """
         获取所有技能的摘要信息。
@@ -160,8 +219,8 @@ class SkillsManager:
                 - 最多返回 limit 个结果
         
         匹配算法:
-            1. 将查询分词
-            2. 计算每个技能的相关性得分
+            1. 将查询分词，用三元组索引筛选候选技能
+            2. 计算每个候选技能的相关性得分
             3. 名称匹配权重 0.8，描述匹配权重 0.6
             4. 只返回得分超过 0.3 的技能
             5. 按得分降序排序
@@ -178,8 +237,15 @@ class SkillsManager:
         query_lower = query.lower()
         query_words = set(query_lower.split())
         
-        # 遍历所有技能
-        for skill in self.skills:
+        # 用索引缩小范围（按原顺序遍历，保证同分结果顺序不变）
+        candidates = self._candidate_indices(query_words)
+        if candidates is None:
+            skills = self.skills
+        else:
+            skills = [self.skills[i] for i in sorted(candidates)]
+        
+        # 遍历候选技能
+        for skill in skills:
             # 计算相关性得分
             score = self._calculate_relevance(skill, query_lower, query_words)
             
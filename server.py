@@ -26,6 +26,7 @@ API 端点：
     GET  /sessions      - 列出会话
     POST /sessions/new  - 创建新会话
     POST /sessions/{id}/load - 加载会话
+    POST /sessions/{id}/release - 释放会话运行时
     POST /chat          - 发送消息（SSE 流式）
     POST /auth/register - 用户注册
     POST /auth/token    - 获取令牌
@@ -40,26 +41,40 @@ API 端点：
 # =============================================================================
 
 import os           # 操作系统接口，用于环境变量
-import json         # JSON 数据处理，用于 SSE 事件数据
+import json         # JSON 数据处理，用于配置文件和 SSE 事件数据（orjson 不可用时）
 import asyncio      # 异步 I/O，用于异步生成器
 from pathlib import Path  # 面向对象的文件路径处理
 from datetime import datetime  # 日期时间处理，用于生成会话 ID
 import re  # 正则表达式，用于安全检查
+import functools  # 函数工具，用于缓存会话路径
+import operator  # 运算符函数，用于排序键
+import heapq  # 堆算法，用于取最新的 N 个会话
+import sys  # 系统接口，用于字符串驻留和平台判断
+from collections import OrderedDict  # 有序字典，用于实现 LRU 运行时缓存
+from dataclasses import dataclass, field  # 数据类，用于用户状态
 
 # =============================================================================
 # 第三方库导入
 # =============================================================================
 
 from dotenv import load_dotenv  # 从 .env 文件加载环境变量
-from typing import AsyncGenerator, Dict, Any, Optional  # 类型提示
+from typing import AsyncGenerator, Callable, Dict, Any, List, Optional, Set, Tuple  # 类型提示
 
 # FastAPI 相关导入
 from fastapi import FastAPI, Request, Depends, HTTPException  # Web 框架核心
-from fastapi.responses import StreamingResponse, FileResponse  # 响应类型
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, ORJSONResponse  # 响应类型
 from fastapi.staticfiles import StaticFiles  # 静态文件服务
 from fastapi.middleware.cors import CORSMiddleware  # CORS 中间件
 from pydantic import BaseModel  # 数据验证
 
+# orjson: C 实现的 JSON 序列化库（可选依赖）
+# 直接输出 bytes，比标准库 json 快数倍；未安装时回退到标准库
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # =============================================================================
 # 项目内部模块导入
 # =============================================================================
@@ -69,6 +84,7 @@ from ag import (
     LLMTransport,      # LLM 传输层
     ToolExecutor,      # 工具执行器
     AgentRuntime,      # Agent 运行时
+    ContextManager,    # 上下文管理器
 )
 
 from log.logger import ConversationLogger
@@ -127,10 +143,12 @@ from agent_tools.mcp.transport import StdioTransport, SseTransport
 
 # 创建 FastAPI 应用实例
 # FastAPI 是一个现代、高性能的 Python Web 框架
+# 安装了 orjson 时用 ORJSONResponse 作为默认响应类，所有 JSON 接口都走 C 实现的序列化
 app = FastAPI(
     title="ownAgent API",
     description="AI 编程助手 API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
 )
 
 
@@ -148,6 +166,16 @@ def on_startup():
     auth_router.init_db()
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    """
+    应用关闭时执行的清理函数。
+    
+    关闭 MCP 客户端池中的所有连接（终止子进程 / 断开 SSE）。
+    """
+    await close_mcp_client_pool()
+
+
 # =============================================================================
 # CORS 中间件配置
 # =============================================================================
@@ -210,13 +238,244 @@ SESSIONS_DIR.mkdir(exist_ok=True)  # 确保目录存在
 # 会话列表（暂未使用）
 sessions = []
 
-# 运行时存储：映射 "用户ID:会话ID" -> AgentRuntime
+class RuntimeCache:
+    """
+    运行时 LRU 缓存 - 限制常驻内存中的 AgentRuntime 数量。
+    
+    普通 dict 会随着用户和会话的增加无限增长，导致内存泄漏。
+    这里使用 OrderedDict 实现一个容量有限的 LRU：
+    - 命中时将条目移到末尾（最近使用）
+    - 超出容量时淘汰最久未使用的条目，并异步关闭其 MCP 客户端
+    
+    属性:
+        maxsize (int): 最大缓存的运行时数量
+        owner (Optional[int]): 所属用户 ID；设置后条目同时登记到进程级的
+            最近使用列表，受全局上限 MAX_RUNTIMES_TOTAL 约束
+        _data (OrderedDict): 存储 会话ID -> AgentRuntime
+    """
+    
+    def __init__(self, maxsize: int = 256, owner: Optional[int] = None):
+        self.maxsize = maxsize
+        self.owner = owner
+        self._data: "OrderedDict[str, AgentRuntime]" = OrderedDict()
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: str) -> Optional[AgentRuntime]:
+        """获取运行时，命中时标记为最近使用。"""
+        runtime = self._data.get(key)
+        if runtime is not None:
+            self._data.move_to_end(key)
+            if self.owner is not None:
+                _runtime_recency.move_to_end((self.owner, key))
+        return runtime
+    
+    def put(self, key: str, runtime: AgentRuntime):
+        """存入运行时，超出容量时淘汰最久未使用的条目；被覆盖的旧运行时同样会被释放。"""
+        # 驻留键字符串，与 UserState.active_sid 共享同一个对象
+        key = sys.intern(key)
+        replaced = self._data.get(key)
+        if replaced is not None and replaced is not runtime:
+            _dispose_in_background(replaced)
+        self._data[key] = runtime
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, evicted = self._data.popitem(last=False)
+            if self.owner is not None:
+                _runtime_recency.pop((self.owner, evicted_key), None)
+            _dispose_in_background(evicted)
+        
+        if self.owner is not None:
+            _runtime_recency[(self.owner, key)] = None
+            _runtime_recency.move_to_end((self.owner, key))
+            _enforce_global_runtime_limit()
+    
+    def pop(self, key: str) -> Optional[AgentRuntime]:
+        """移除并返回运行时，不存在时返回 None。"""
+        if self.owner is not None:
+            _runtime_recency.pop((self.owner, key), None)
+        return self._data.pop(key, None)
+    
+    def clear(self) -> List[AgentRuntime]:
+        """移除并返回全部运行时。"""
+        if self.owner is not None:
+            for key in self._data:
+                _runtime_recency.pop((self.owner, key), None)
+        runtimes = list(self._data.values())
+        self._data.clear()
+        return runtimes
+
+
+class SessionAutosaver:
+    """
+    会话防抖自动保存器。
+    
+    每条消息都重写整个历史 JSON 的代价与会话长度成正比。
+    这里只在历史变更时标记为"脏"，由后台任务最多每 delay 秒写一次盘，
+    把一轮对话中的多次变更合并成一次写入。
+    
+    属性:
+        context: 运行时的 ContextManager
+        path (str): 会话文件路径
+        delay (float): 防抖间隔（秒）
+    """
+    
+    def __init__(self, context, path: str, delay: float = 2.0):
+        self.context = context
+        self.path = path
+        self.delay = delay
+        self._dirty = asyncio.Event()
+        # 同一时刻只允许一次写盘：后台保存和 flush() 可能同时触发，
+        # 两个线程并发追加会读到同一个 _persisted_len，把消息重复写入日志
+        self._save_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+    
+    def mark_dirty(self):
+        """标记历史已变更，等待后台任务保存。"""
+        self._dirty.set()
+    
+    async def _save(self):
+        async with self._save_lock:
+            # 等锁期间另一次保存可能已经写入了这些变更
+            if not self._dirty.is_set():
+                return
+            self._dirty.clear()
+            # 增量追加新消息，日志过大时自动压缩为快照
+            save = asyncio.ensure_future(asyncio.to_thread(self.context.append_history, self.path))
+            try:
+                await asyncio.shield(save)
+            except asyncio.CancelledError:
+                # 被取消（如 close()）时线程仍在写盘，等它结束后再释放锁
+                await save
+                raise
+    
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.delay)
+            try:
+                await self._save()
+            except Exception as e:
+                print(f"[Error] Failed to autosave session {self.path}: {e}")
+    
+    async def flush(self):
+        """如果有未保存的变更，立即保存。"""
+        if self._dirty.is_set():
+            await self._save()
+    
+    async def close(self):
+        """保存未写入的变更并停止后台任务。"""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
+
+
+# 后台释放任务的强引用：事件循环只持有任务的弱引用，
+# 不保存的话任务可能在写盘途中被垃圾回收
+_BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+
+def _dispose_in_background(runtime: AgentRuntime):
+    """在后台释放运行时，并在任务完成前保持对它的引用。"""
+    task = asyncio.create_task(_dispose_runtime(runtime))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+async def _dispose_runtime(runtime: AgentRuntime):
+    """
+    释放运行时持有的资源。
+    
+    包括保存未写入的历史并停止自动保存任务，
+    以及关闭 MCP 客户端（停止子进程 / 断开 SSE 连接）。
+    """
+    try:
+        await runtime.autosaver.close()
+    except Exception as e:
+        print(f"[Error] Failed to flush session on release: {e}")
+    
+    for client in runtime.mcp_clients:
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"[Error] Failed to close MCP client: {e}")
+
+
+# 每个用户最多常驻内存的运行时数量，超出时按 LRU 淘汰
+MAX_RUNTIMES_PER_USER = 16
+
+# 整个进程最多常驻内存的运行时数量（跨所有用户），超出时淘汰全局最久未使用的
+MAX_RUNTIMES_TOTAL = 256
+
+# 最多保留的用户状态数量，超出时淘汰最久未访问的用户（连同其运行时）
+MAX_USER_STATES = 4096
+
+# 进程级最近使用列表：(用户ID, 会话ID)，最久未使用的在最前面
+_runtime_recency: "OrderedDict[Tuple[int, str], None]" = OrderedDict()
+
+
+def _enforce_global_runtime_limit():
+    """超出 MAX_RUNTIMES_TOTAL 时，从所属用户的缓存中淘汰全局最久未使用的运行时。"""
+    while len(_runtime_recency) > MAX_RUNTIMES_TOTAL:
+        (user_id, session_id), _ = _runtime_recency.popitem(last=False)
+        state = _users.get(user_id)
+        if state is None:
+            continue
+        runtime = state.runtimes.pop(session_id)
+        if runtime is not None:
+            _dispose_in_background(runtime)
+
+
+@dataclass
+class UserState:
+    """
+    单个用户的内存状态。
+    
+    把"活跃会话"和"运行时缓存"放在同一个对象里，
+    每个请求只需一次按用户 ID 的字典查找。
+    
+    属性:
+        user_id (int): 用户 ID
+        active_sid (Optional[str]): 当前活跃的会话 ID
+        runtimes (RuntimeCache): 会话ID -> AgentRuntime 的 LRU 缓存，
+            同时受每用户上限和进程级上限约束
+    
+    注意:
+        active_sid 和缓存键都经过 sys.intern，使用活跃会话的请求
+        在查找运行时时命中同一个字符串对象，不必重新计算哈希和逐字符比较。
+    """
+    user_id: int
+    active_sid: Optional[str] = None
+    runtimes: RuntimeCache = field(init=False)
+    
+    def __post_init__(self):
+        self.runtimes = RuntimeCache(maxsize=MAX_RUNTIMES_PER_USER, owner=self.user_id)
+
+
+# 用户状态存储：映射 用户ID -> UserState，按最近访问排序
 # 每个用户的每个会话都有独立的运行时实例
-session_runtimes: Dict[str, Any] = {}
+_users: "OrderedDict[int, UserState]" = OrderedDict()
 
-# 活跃会话：映射 用户ID -> 当前活跃的会话ID
-# 用于跟踪用户当前正在使用的会话
-active_sessions: Dict[int, str] = {}
+
+def get_user_state(user_id: int) -> UserState:
+    """获取用户状态，不存在时创建；超出 MAX_USER_STATES 时淘汰最久未访问的用户。"""
+    state = _users.get(user_id)
+    if state is None:
+        state = _users[user_id] = UserState(user_id)
+        while len(_users) > MAX_USER_STATES:
+            _, idle = _users.popitem(last=False)
+            for runtime in idle.runtimes.clear():
+                _dispose_in_background(runtime)
+    else:
+        _users.move_to_end(user_id)
+    return state
 
 
 # =============================================================================
@@ -237,6 +496,7 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "glm4.7")  # 模型名称，默认 glm4
 # 辅助函数
 # =============================================================================
 
+@functools.lru_cache(maxsize=4096)
 def get_session_path(user_id: int, session_id: str) -> Path:
     """
     获取会话文件的路径。
@@ -252,58 +512,275 @@ def get_session_path(user_id: int, session_id: str) -> Path:
         >>> path = get_session_path(1, "20240101_120000")
         >>> print(path)
         sessions/1_session_20240101_120000.json
+    
+    注意:
+        SESSIONS_DIR 是常量，结果只取决于参数，因此用 lru_cache 缓存，
+        避免每次请求都重新拼接字符串和构造 Path 对象。
     """
     return SESSIONS_DIR / f"{user_id}_session_{session_id}.json"
 
 
-async def init_mcp_servers(runtime: AgentRuntime):
+@functools.lru_cache(maxsize=4096)
+def get_session_prefix(user_id: int) -> str:
     """
-    初始化 MCP 服务器并注册工具。
+    获取用户会话文件名的前缀（带缓存）。
+    
+    参数:
+        user_id (int): 用户 ID
+    
+    返回:
+        str: 前缀，格式为 {user_id}_session_
+    
+    注意:
+        与 get_session_path 一样使用有界的 lru_cache，缓存不会随用户数无限增长。
     """
-    config_path = Path("mcp_config.json")
-    if not config_path.exists():
-        return
+    return f"{user_id}_session_"
+
+
+# 内置工具表：(工具函数, 参数模型)
+# 静态的注册表，导入时由 _build_prototype_executor 一次性注册
+_TOOL_TABLE: Tuple[Tuple[Callable, type], ...] = (
+    # --- 文件操作工具 ---
+    (list_files, ListFilesArgs),
+    (read_file, ReadFileArgs),
+    (write_to_file, WriteToFileArgs),
+    (delete_file, DeleteFileArgs),
+    (search_files, SearchFilesArgs),
+    (edit_file, EditFileArgs),
+    # --- 系统工具 ---
+    (execute_command, ExecuteCommandArgs),
+    # --- 浏览器工具 ---
+    (browser_action, BrowserActionArgs),
+    # --- 差异工具 ---
+    (apply_diff, ApplyDiffArgs),
+    # --- 交互工具 ---
+    (ask_followup_question, AskFollowupQuestionArgs),
+    (attempt_completion, AttemptCompletionArgs),
+    (new_task, NewTaskArgs),
+    (switch_mode, SwitchModeArgs),
+    (fetch_instructions, FetchInstructionsArgs),
+    # --- 技能工具 ---
+    (list_skills, ListSkillsArgs),
+    (search_skills, SearchSkillsArgs),
+    (get_skill, GetSkillArgs),
+    # --- Todo 工具 ---
+    (read_todo, ReadTodoArgs),
+    (write_todo, WriteTodoArgs),
+    (update_todo, UpdateTodoArgs),
+)
+
+
+def _build_prototype_executor() -> ToolExecutor:
+    """
+    构建原型工具执行器。
+    
+    内置工具集在进程内是固定的，因此只在导入时注册一次，
+    每个新运行时通过 clone() 复制，避免每次创建会话都重新注册和生成 Schema。
+    
+    返回:
+        ToolExecutor: 注册了 _TOOL_TABLE 中所有工具的执行器
+    """
+    executor = ToolExecutor()
+    for func, args_model in _TOOL_TABLE:
+        executor.register(func, args_model)
+    return executor
+
+
+# 原型工具执行器：导入时注册一次，所有运行时共享同一份注册表的副本
+_PROTOTYPE_EXECUTOR = _build_prototype_executor()
+
+# 共享技能管理器：技能目录在进程内视为不可变，只扫描一次
+_SHARED_SKILLS: Optional[SkillsManager] = None
+_SHARED_SKILLS_LOCK = asyncio.Lock()
+
+
+async def get_shared_skills_manager() -> SkillsManager:
+    """
+    获取进程共享的技能管理器。
+    
+    第一次调用时扫描 .skills 目录，之后直接返回缓存的实例。
+    使用 asyncio.Lock 防止并发的首次请求重复加载。
+    
+    返回:
+        SkillsManager: 已加载技能的管理器
+    """
+    global _SHARED_SKILLS
+    if _SHARED_SKILLS is not None:
+        return _SHARED_SKILLS
+    
+    async with _SHARED_SKILLS_LOCK:
+        if _SHARED_SKILLS is None:
+            manager = SkillsManager(Path(".skills"))
+            manager.load_skills()  # 加载所有技能
+            _SHARED_SKILLS = manager
+    return _SHARED_SKILLS
+
+
+# MCP 配置缓存：(文件修改时间, 解析后的配置)
+# 配置文件基本不变，只有修改时间变化时才重新解析
+_mcp_config_cache: Optional[Tuple[float, dict]] = None
+
+# MCP 客户端池：映射 服务器名 -> (服务器配置, 客户端, 工具列表)
+# MCP 客户端创建代价高（子进程 / SSE 握手），所有运行时共享同一个连接
+_MCP_CLIENT_POOL: Dict[str, Tuple[dict, McpClient, list]] = {}
 
+# 每个服务器一把锁，防止并发的首次请求重复建立连接
+_MCP_POOL_LOCKS: Dict[str, asyncio.Lock] = {}
+
+
+async def load_mcp_config() -> Optional[dict]:
+    """
+    读取 mcp_config.json，按文件修改时间缓存解析结果。
+    
+    文件读取在线程池中执行，避免慢速文件系统（NFS、SMB）阻塞事件循环。
+    
+    返回:
+        Optional[dict]: 解析后的配置，文件不存在时返回 None
+    """
+    global _mcp_config_cache
+    config_path = Path("mcp_config.json")
     try:
-        with open(config_path, "r", encoding="utf-8") as f:
-            config = json.load(f)
-            
-        servers = config.get("mcpServers", {})
-        for name, server_config in servers.items():
+        mtime = config_path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    
+    if _mcp_config_cache is not None and _mcp_config_cache[0] == mtime:
+        return _mcp_config_cache[1]
+    
+    raw = await asyncio.to_thread(config_path.read_bytes)
+    config = orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+    _mcp_config_cache = (mtime, config)
+    return config
+
+
+async def get_pooled_mcp_client(name: str, server_config: dict) -> Optional[Tuple[McpClient, list]]:
+    """
+    从客户端池获取 MCP 客户端，不存在时创建并连接。
+    
+    工具列表和客户端一起缓存，复用时不再发送 tools/list 请求。
+    如果服务器配置发生变化，会关闭旧客户端并重新连接。
+    
+    参数:
+        name (str): 服务器名称
+        server_config (dict): 服务器配置
+    
+    返回:
+        Optional[Tuple[McpClient, list]]: (客户端, 工具列表)，配置无效时返回 None
+    """
+    lock = _MCP_POOL_LOCKS.setdefault(name, asyncio.Lock())
+    async with lock:
+        entry = _MCP_CLIENT_POOL.get(name)
+        if entry is not None:
+            cached_config, client, tools = entry
+            # 接收循环结束（子进程退出 / SSE 断开）时 is_connected 会被清除
+            if cached_config == server_config and client.is_connected:
+                return client, tools
+            # 配置已变化或连接已断开，关闭旧客户端
+            _MCP_CLIENT_POOL.pop(name, None)
             try:
-                print(f"[Info] Initializing MCP server: {name}")
-                transport = None
-                
-                # Command-based (Stdio)
-                if "command" in server_config:
-                    cmd = server_config["command"]
-                    args = server_config.get("args", [])
-                    env = server_config.get("env")
-                    transport = StdioTransport(cmd, args, env)
-                
-                # URL-based (SSE)
-                elif "url" in server_config:
-                    url = server_config["url"]
-                    transport = SseTransport(url)
-                
-                if transport:
-                    client = McpClient(transport)
-                    await client.connect()
-                    
-                    # Store client in runtime to keep it alive
-                    if not hasattr(runtime, "mcp_clients"):
-                        runtime.mcp_clients = []
-                    runtime.mcp_clients.append(client)
-                    
-                    tools = await client.list_tools()
-                    for tool in tools:
-                        runtime.executor.register_mcp_tool(tool, client)
-                        
+                await client.close()
             except Exception as e:
-                print(f"[Error] Failed to initialize MCP server {name}: {e}")
-                
+                print(f"[Error] Failed to close MCP client {name}: {e}")
+        
+        print(f"[Info] Initializing MCP server: {name}")
+        transport = None
+        
+        # Command-based (Stdio)
+        if "command" in server_config:
+            cmd = server_config["command"]
+            args = server_config.get("args", [])
+            env = server_config.get("env")
+            transport = StdioTransport(cmd, args, env)
+        
+        # URL-based (SSE)
+        elif "url" in server_config:
+            url = server_config["url"]
+            transport = SseTransport(url)
+        
+        if not transport:
+            return None
+        
+        client = McpClient(transport)
+        await client.connect()
+        tools = await client.list_tools()
+        
+        _MCP_CLIENT_POOL[name] = (server_config, client, tools)
+        return client, tools
+
+
+async def prune_mcp_client_pool(names):
+    """
+    关闭并移除不再出现在配置中的服务器对应的池化客户端。
+    
+    参数:
+        names: 当前配置中的服务器名称集合
+    """
+    for name in [n for n in _MCP_CLIENT_POOL if n not in names]:
+        lock = _MCP_POOL_LOCKS.setdefault(name, asyncio.Lock())
+        async with lock:
+            entry = _MCP_CLIENT_POOL.pop(name, None)
+            if entry is None:
+                continue
+            print(f"[Info] MCP server removed from config, closing: {name}")
+            try:
+                await entry[1].close()
+            except Exception as e:
+                print(f"[Error] Failed to close MCP client {name}: {e}")
+
+
+async def close_mcp_client_pool():
+    """关闭客户端池中的所有 MCP 客户端。"""
+    while _MCP_CLIENT_POOL:
+        name, (_, client, _) = _MCP_CLIENT_POOL.popitem()
+        try:
+            await client.close()
+        except Exception as e:
+            print(f"[Error] Failed to close MCP client {name}: {e}")
+
+
+async def init_mcp_servers(runtime: AgentRuntime):
+    """
+    初始化 MCP 服务器并注册工具。
+    
+    客户端来自进程级的客户端池，生命周期是全局的，
+    因此不会挂到 runtime.mcp_clients 上，运行时被淘汰时也不会关闭它们。
+    """
+    try:
+        config = await load_mcp_config()
     except Exception as e:
         print(f"[Error] Failed to load MCP config: {e}")
+        return
+    
+    # 配置中已删除的服务器：关闭其池化客户端
+    servers = (config or {}).get("mcpServers", {})
+    await prune_mcp_client_pool(servers.keys())
+    
+    if not servers:
+        return
+    
+    async def _init_one(name: str, server_config: dict) -> Optional[Tuple[McpClient, list]]:
+        try:
+            return await get_pooled_mcp_client(name, server_config)
+        except Exception as e:
+            print(f"[Error] Failed to initialize MCP server {name}: {e}")
+            return None
+    
+    # 并行连接所有服务器，总耗时取决于最慢的握手而不是所有握手之和
+    results = await asyncio.gather(
+        *(_init_one(name, server_config) for name, server_config in servers.items())
+    )
+    
+    # 按配置顺序注册工具，保证工具列表顺序稳定
+    for pooled in results:
+        if pooled is None:
+            continue
+        client, tools = pooled
+        for tool in tools:
+            runtime.executor.register_mcp_tool(tool, client)
+
+
+# 每个 (用户ID, 会话ID) 的运行时创建锁
+_RUNTIME_CREATION_LOCKS: Dict[Tuple[int, str], asyncio.Lock] = {}
 
 
 async def get_or_create_runtime(user_id: int, session_id: str) -> AgentRuntime:
@@ -323,20 +800,39 @@ async def get_or_create_runtime(user_id: int, session_id: str) -> AgentRuntime:
     
     创建流程：
         1. 创建 LLM 传输层
-        2. 初始化技能系统
-        3. 创建工具执行器并注册所有工具
+        2. 获取共享的技能系统
+        3. 从原型复制工具执行器
         4. 创建 Agent 运行时
         5. 如果存在历史记录，加载历史
         6. 初始化 MCP 服务器
     """
-    # 构建运行时的唯一标识
-    runtime_key = f"{user_id}:{session_id}"
-    
     # 检查是否已有缓存的运行时
-    if runtime_key in session_runtimes:
-        return session_runtimes[runtime_key]
-    
-    # --- 创建新的运行时 ---
+    state = get_user_state(user_id)
+    cached = state.runtimes.get(session_id)
+    if cached is not None:
+        return cached
+    
+    # 创建过程中有多次 await，同一会话的并发首个请求（如 /load 和 /chat）
+    # 会同时未命中缓存；按会话加锁，后到的请求等待并复用先创建的运行时
+    key = (user_id, session_id)
+    lock = _RUNTIME_CREATION_LOCKS.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            cached = state.runtimes.get(session_id)
+            if cached is not None:
+                return cached
+            runtime = await _create_runtime(user_id, session_id)
+            # 缓存运行时（重新获取用户状态：创建期间旧状态可能已被淘汰）
+            get_user_state(user_id).runtimes.put(session_id, runtime)
+            return runtime
+    finally:
+        # 没有其他请求持有锁时移除，避免锁字典无限增长
+        if not lock.locked() and _RUNTIME_CREATION_LOCKS.get(key) is lock:
+            del _RUNTIME_CREATION_LOCKS[key]
+
+
+async def _create_runtime(user_id: int, session_id: str) -> AgentRuntime:
+    """创建新的会话运行时（不做缓存），由 get_or_create_runtime 在会话锁内调用。"""
     
     # 步骤 1: 创建 LLM 传输层
     transport = LLMTransport(
@@ -345,50 +841,11 @@ async def get_or_create_runtime(user_id: int, session_id: str) -> AgentRuntime:
         model=OPENAI_MODEL
     )
     
-    # 步骤 2: 初始化技能系统
-    skills_root = Path(".skills")
-    # skills_loader = SkillsLoader(skills_root)
-    skills_manager = SkillsManager(skills_root)
-    skills_manager.load_skills()  # 加载所有技能
-
-    # 步骤 3: 创建工具执行器
-    executor = ToolExecutor()
-    
-    # 注册所有工具
-    # --- 文件操作工具 ---
-    executor.register(list_files, ListFilesArgs)
-    executor.register(read_file, ReadFileArgs)
-    executor.register(write_to_file, WriteToFileArgs)
-    executor.register(delete_file, DeleteFileArgs)
-    executor.register(search_files, SearchFilesArgs)
-    executor.register(edit_file, EditFileArgs)
-    
-    # --- 系统工具 ---
-    executor.register(execute_command, ExecuteCommandArgs)
-    
-    # --- 浏览器工具 ---
-    executor.register(browser_action, BrowserActionArgs)
-    
-    # --- 差异工具 ---
-    executor.register(apply_diff, ApplyDiffArgs)
-    
-    # --- 交互工具 ---
-    executor.register(ask_followup_question, AskFollowupQuestionArgs)
-    executor.register(attempt_completion, AttemptCompletionArgs)
-    executor.register(new_task, NewTaskArgs)
-    executor.register(switch_mode, SwitchModeArgs)
-    executor.register(fetch_instructions, FetchInstructionsArgs)
-    
-    
-    # --- 技能工具 ---
-    executor.register(list_skills, ListSkillsArgs)
-    executor.register(search_skills, SearchSkillsArgs)
-    executor.register(get_skill, GetSkillArgs)
+    # 步骤 2: 获取共享的技能系统（整个进程只加载一次）
+    skills_manager = await get_shared_skills_manager()
 
-    # --- Todo 工具 ---
-    executor.register(read_todo, ReadTodoArgs)
-    executor.register(write_todo, WriteTodoArgs)
-    executor.register(update_todo, UpdateTodoArgs)
+    # 步骤 3: 从原型复制工具执行器（工具已在导入时注册）
+    executor = _PROTOTYPE_EXECUTOR.clone()
 
     # 步骤 4: 创建日志记录器
     logger = ConversationLogger()
@@ -409,33 +866,72 @@ async def get_or_create_runtime(user_id: int, session_id: str) -> AgentRuntime:
     # 步骤 6: 如果存在历史文件，加载历史
     if session_path.exists():
         try:
-            runtime.context.load_history(str(session_path))
+            # 在线程池中读取文件，避免阻塞事件循环
+            await asyncio.to_thread(runtime.context.load_history, str(session_path))
         except Exception:
             pass  # 忽略加载错误
 
+    # 启用防抖自动保存：历史变更只标记为脏，由后台任务合并写盘
+    runtime.autosaver = SessionAutosaver(runtime.context, str(session_path))
+    runtime.context.on_change = runtime.autosaver.mark_dirty
+
     # 步骤 7: 初始化 MCP 服务器
     await init_mcp_servers(runtime)
-
-    # 缓存运行时
-    session_runtimes[runtime_key] = runtime
     return runtime
 
 
-async def save_user_session(user_id: int):
+async def release_runtime(user_id: int, session_id: str) -> bool:
     """
-    手动保存用户会话（已弃用）。
+    显式释放用户的会话运行时。
     
-    由于启用了自动保存，此函数保留用于手动触发。
+    用于登出或删除会话时立即回收内存和 MCP 连接，
+    而不必等待 LRU 淘汰。
     
     参数:
         user_id (int): 用户 ID
+        session_id (str): 会话 ID
+    
+    返回:
+        bool: 运行时存在并已释放返回 True，否则返回 False
     """
-    if user_id not in active_sessions:
-        return
-    sid = active_sessions[user_id]
-    path = get_session_path(user_id, sid)
-    runtime = await get_or_create_runtime(user_id, sid)
-    runtime.context.save_history(str(path))
+    state = _users.get(user_id)
+    runtime = state.runtimes.pop(session_id) if state is not None else None
+    if runtime is None:
+        return False
+    await _dispose_runtime(runtime)
+    return True
+
+
+def _dumps_bytes(obj: Any) -> bytes:
+    """将对象序列化为 UTF-8 JSON bytes（不转义非 ASCII 字符）。"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=512)
+def _encode_small_sse_event(event_type: str, content: str) -> bytes:
+    """编码 {"type", "content"} 形式的小事件，结果按 (类型, 内容) 缓存。"""
+    return b"data: " + _dumps_bytes({"type": event_type, "content": content}) + b"\n\n"
+
+
+def encode_sse_event(event: Dict[str, Any]) -> bytes:
+    """
+    将事件编码为 SSE 格式的 bytes：data: {json}\n\n
+    
+    直接返回 bytes，StreamingResponse 无需再次编码。
+    像 {"type": "finished", "content": "Done"} 这样反复出现的小事件会命中缓存。
+    
+    参数:
+        event (dict): 事件字典
+    
+    返回:
+        bytes: SSE 数据帧
+    """
+    content = event.get("content")
+    if len(event) == 2 and "type" in event and isinstance(content, str) and len(content) <= 64:
+        return _encode_small_sse_event(event["type"], content)
+    return b"data: " + _dumps_bytes(event) + b"\n\n"
 
 
 # =============================================================================
@@ -474,13 +970,17 @@ async def get_index():
 # -----------------------------------------------------------------------------
 
 @app.get("/sessions")
-async def list_sessions(current_user: auth_models.User = Depends(auth_deps.get_current_active_user)):
+async def list_sessions(
+    limit: Optional[int] = None,
+    current_user: auth_models.User = Depends(auth_deps.get_current_active_user)
+):
     """
     列出当前用户的所有会话。
     
     需要认证：是
     
     参数:
+        limit (Optional[int]): 查询参数，只返回最新的 limit 个会话，默认全部
         current_user: 当前登录用户（通过依赖注入获取）
     
     返回:
@@ -496,33 +996,39 @@ async def list_sessions(current_user: auth_models.User = Depends(auth_deps.get_c
         1. 扫描 sessions 目录
         2. 过滤出当前用户的会话文件
         3. 按修改时间排序（最新的在前）
+           指定 limit 时用 heapq.nlargest 做部分排序，O(M log N) 而不是 O(M log M)
     """
     sessions = []
     if not SESSIONS_DIR.exists():
         return {"sessions": []}
     
     # 构建用户会话文件的前缀
-    prefix = f"{current_user.id}_session_"
-    
-    # 遍历匹配的文件
-    files = list(SESSIONS_DIR.glob(f"{prefix}*.json"))
-    print(f"[DEBUG] Listing sessions for user {current_user.id}. Found {len(files)} files.")
-    
-    for f in files:
-        # 从文件名提取会话 ID
-        sid = f.stem.replace(prefix, "")
-        stat = f.stat()
-        sessions.append({
-            "id": sid,
-            "timestamp": stat.st_mtime,  # 修改时间戳
-            "filename": f.name
-        })
+    prefix = get_session_prefix(current_user.id)
+    
+    # 单次 scandir 遍历目录
+    # DirEntry 会缓存目录项信息（Windows 上包含修改时间），避免每个文件额外 stat
+    with os.scandir(SESSIONS_DIR) as it:
+        for entry in it:
+            name = entry.name
+            if not (name.startswith(prefix) and name.endswith(".json")):
+                continue
+            st = entry.stat()
+            sessions.append({
+                "id": name[len(prefix):-5],  # 从文件名提取会话 ID
+                "timestamp": st.st_mtime,    # 修改时间戳
+                "filename": name
+            })
+    print(f"[DEBUG] Listing sessions for user {current_user.id}. Found {len(sessions)} files.")
     
     # 按时间倒序排序
-    sessions.sort(key=lambda x: x["timestamp"], reverse=True)
+    if limit is not None:
+        sessions = heapq.nlargest(max(limit, 0), sessions, key=operator.itemgetter("timestamp"))
+    else:
+        sessions.sort(key=operator.itemgetter("timestamp"), reverse=True)
     
     # 获取当前活跃会话
-    cur_sid = active_sessions.get(current_user.id, None)
+    state = _users.get(current_user.id)
+    cur_sid = state.active_sid if state is not None else None
     print(f"[DEBUG] Current active session: {cur_sid}")
     return {"sessions": sessions, "current_session_id": cur_sid}
 
@@ -559,20 +1065,25 @@ async def new_session(current_user: auth_models.User = Depends(auth_deps.get_cur
     path = get_session_path(current_user.id, new_sid)
     print(f"[DEBUG] Saving initial session to: {path.absolute()}")
     try:
-        runtime.context.save_history(str(path))
+        await asyncio.to_thread(runtime.context.save_history, str(path))
         print(f"[DEBUG] Session file created successfully: {path.exists()}")
     except Exception as e:
         print(f"[ERROR] Failed to save session file: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to create session file: {str(e)}")
     
     # 设为活跃会话
-    active_sessions[current_user.id] = new_sid
+    get_user_state(current_user.id).active_sid = sys.intern(new_sid)
     
     return {"id": new_sid, "message": "New session started"}
 
 
 @app.post("/sessions/{session_id}/load")
-async def load_session(session_id: str, current_user: auth_models.User = Depends(auth_deps.get_current_active_user)):
+async def load_session(
+    session_id: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    current_user: auth_models.User = Depends(auth_deps.get_current_active_user)
+):
     """
     加载指定会话。
     
@@ -580,14 +1091,20 @@ async def load_session(session_id: str, current_user: auth_models.User = Depends
     
     参数:
         session_id (str): 要加载的会话 ID
+        offset (int): 查询参数，跳过的消息数量（不含系统提示词），默认 0
+        limit (Optional[int]): 查询参数，最多返回的消息数量，默认全部
         current_user: 当前登录用户
     
     返回:
         dict: {
             "id": "会话ID",
-            "history": [对话历史消息列表]
+            "history": [对话历史消息列表],
+            "total": 消息总数（不含系统提示词）
         }
     
+    分页：
+        超长会话可以通过 ?offset=&limit= 分段获取，只复制请求的那一段消息
+    
     安全检查：
         - 只能加载自己的会话（通过文件名前缀验证）
     """
@@ -602,11 +1119,41 @@ async def load_session(session_id: str, current_user: auth_models.User = Depends
     runtime = await get_or_create_runtime(current_user.id, session_id)
     
     # 设为活跃会话
-    active_sessions[current_user.id] = session_id
+    get_user_state(current_user.id).active_sid = sys.intern(session_id)
     
-    # 返回历史消息（跳过系统提示词）
-    msgs = runtime.context.history[1:] if len(runtime.context.history) > 0 else []
-    return {"id": session_id, "history": msgs}
+    # 返回历史消息（跳过系统提示词），只切出请求的那一段
+    history = runtime.context.history
+    start = 1 + max(offset, 0)
+    stop = start + max(limit, 0) if limit is not None else None
+    msgs = history[start:stop]
+    return {"id": session_id, "history": msgs, "total": max(len(history) - 1, 0)}
+
+
+@app.post("/sessions/{session_id}/release")
+async def release_session(session_id: str, current_user: auth_models.User = Depends(auth_deps.get_current_active_user)):
+    """
+    释放会话的运行时（会话文件保留）。
+    
+    需要认证：是
+    
+    前端在用户点击退出登录时对当前会话调用，立即回收该会话占用的内存和 MCP 连接。
+    之后再次加载会话时会从文件重建运行时。
+    
+    参数:
+        session_id (str): 会话 ID
+        current_user: 当前登录用户
+    
+    返回:
+        dict: {"released": 是否释放了运行时}
+    """
+    released = await release_runtime(current_user.id, session_id)
+    
+    # 如果是当前活跃会话，清除活跃状态
+    state = _users.get(current_user.id)
+    if state is not None and state.active_sid == session_id:
+        state.active_sid = None
+    
+    return {"released": released}
 
 
 @app.delete("/sessions/{session_id}")
@@ -639,12 +1186,19 @@ async def delete_session(session_id: str, current_user: auth_models.User = Depen
         raise HTTPException(status_code=404, detail="Session not found")
         
     try:
-        # 4. 删除文件
+        # 4. 释放该会话的运行时（先于删除，避免自动保存重新写出文件）
+        await release_runtime(current_user.id, session_id)
+        
+        # 5. 删除快照文件和追加日志
         os.remove(path)
+        journal = ContextManager.journal_path(str(path))
+        if os.path.exists(journal):
+            os.remove(journal)
         
-        # 5. 如果是当前活跃会话，清除活跃状态
-        if active_sessions.get(current_user.id) == session_id:
-            active_sessions.pop(current_user.id, None)
+        # 6. 如果是当前活跃会话，清除活跃状态
+        state = _users.get(current_user.id)
+        if state is not None and state.active_sid == session_id:
+            state.active_sid = None
             
         return {"message": "Session deleted successfully"}
         
@@ -659,7 +1213,10 @@ async def delete_session(session_id: str, current_user: auth_models.User = Depen
 # -----------------------------------------------------------------------------
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest, current_user: auth_models.User = Depends(auth_deps.get_current_active_user)):
+async def chat_endpoint(
+    request: ChatRequest,
+    current_user: auth_models.User = Depends(auth_deps.get_current_active_user)
+) -> StreamingResponse:
     """
     聊天接口 - 使用 SSE 流式响应。
     
@@ -687,44 +1244,59 @@ async def chat_endpoint(request: ChatRequest, current_user: auth_models.User = D
         4. 返回 SSE 响应
     """
     # 确定会话 ID
-    session_id = request.session_id
+    state = get_user_state(current_user.id)
+    session_id: Optional[str] = request.session_id
     
     if not session_id:
         # 如果没有指定会话 ID，使用活跃会话
-        session_id = active_sessions.get(current_user.id)
+        session_id = state.active_sid
     
     if not session_id:
         # 如果没有活跃会话，自动创建
         session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        active_sessions[current_user.id] = session_id
+        state.active_sid = session_id = sys.intern(session_id)
     
     # 获取运行时
-    runtime = await get_or_create_runtime(current_user.id, session_id)
+    runtime: AgentRuntime = await get_or_create_runtime(current_user.id, session_id)
 
     # 定义 SSE 事件生成器
-    async def event_generator():
+    async def event_generator() -> AsyncGenerator[bytes, None]:
         """
         SSE 事件生成器。
         
         将 Runtime 的事件转换为 SSE 格式。
+        
+        生产者任务驱动 runtime.step 并把事件放入有界队列，生成器负责发送。
+        这样客户端接收较慢时不会拖住 LLM 流的读取和工具执行；
+        队列满时生产者才会等待，保留背压。
         """
-        try:
-            # 遍历 Runtime 产生的事件
-            async for event in runtime.step(request.message):
-                # 将事件序列化为 JSON
-                data = json.dumps(event, ensure_ascii=False)
-                # SSE 格式：data: {json}\n\n
-                yield f"data: {data}\n\n"
-                # 短暂休眠，让出控制权
-                await asyncio.sleep(0.01)
-            
-            # 对话完成后自动保存
-            await save_user_session(current_user.id)
+        queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(maxsize=64)
+        
+        async def producer() -> None:
+            try:
+                # 遍历 Runtime 产生的事件
+                async for event in runtime.step(request.message):
+                    await queue.put(event)
+                
+                # 对话完成后立即保存，不再等待防抖间隔
+                await runtime.autosaver.flush()
+                
+            except Exception as e:
+                # 发生错误时返回错误事件
+                await queue.put({"type": "error", "content": str(e)})
             
-        except Exception as e:
-            # 发生错误时返回错误事件
-            error_event = {"type": "error", "content": str(e)}
-            yield f"data: {json.dumps(error_event, ensure_ascii=False)}\n\n"
+            # None 表示事件流结束
+            await queue.put(None)
+        
+        task: asyncio.Task = asyncio.create_task(producer())
+        try:
+            while (event := await queue.get()) is not None:
+                # 序列化为 SSE 格式：data: {json}\n\n
+                yield encode_sse_event(event)
+        finally:
+            # 客户端断开时 StreamingResponse 会关闭生成器，同时取消生产者
+            if not task.done():
+                task.cancel()
 
     # 返回 SSE 流式响应
     # media_type="text/event-stream" 是 SSE 的标准 MIME 类型
@@ -736,12 +1308,22 @@ async def chat_endpoint(request: ChatRequest, current_user: auth_models.User = D
 # =============================================================================
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
     
     # 打印启动信息
     print("Starting Web Server on http://localhost:8000")
     
+    # 在 POSIX 平台上使用 uvloop（基于 libuv 的事件循环）和 httptools（C 实现的 HTTP 解析器）
+    # uvloop 不支持 Windows；未安装时回退到 uvicorn 默认实现
+    run_options = {}
+    if sys.platform != "win32":
+        if importlib.util.find_spec("uvloop"):
+            run_options["loop"] = "uvloop"
+        if importlib.util.find_spec("httptools"):
+            run_options["http"] = "httptools"
+    
     # 启动 Uvicorn ASGI 服务器
     # host="127.0.0.1" 只监听本地连接
     # port=8000 监听 8000 端口
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    uvicorn.run(app, host="127.0.0.1", port=8000, **run_options)
@@ -45,8 +45,14 @@ class SQLQueryExecutor:
     def connect(self) -> None:
         """Establish database connection"""
         try:
-            self.connection = sqlite3.connect(self.db_path)
+            # Autocommit mode: transactions are opened explicitly where batching matters
+            self.connection = sqlite3.connect(self.db_path, isolation_level=None)
             self.cursor = self.connection.cursor()
+            if self.db_path == ":memory:":
+                # Scratch in-memory database: nothing to protect, skip journal fsyncs.
+                # On-disk databases keep SQLite's crash-safe defaults.
+                self.cursor.execute("PRAGMA journal_mode=MEMORY")
+                self.cursor.execute("PRAGMA synchronous=OFF")
             self.logger.info(f"Connected to database: {self.db_path}")
         except sqlite3.Error as e:
             self.logger.error(f"Database connection failed: {e}")
@@ -106,12 +112,6 @@ class SQLQueryExecutor:
             ("Diana Prince", "diana@example.com")
         ]
         
-        for name, email in users:
-            self.cursor.execute(
-                "INSERT OR IGNORE INTO users (name, email) VALUES (?, ?)",
-                (name, email)
-            )
-        
         # Insert products
         products = [
             ("Laptop", 999.99, "Electronics"),
@@ -121,12 +121,6 @@ class SQLQueryExecutor:
             ("Headphones", 149.99, "Electronics")
         ]
         
-        for name, price, category in products:
-            self.cursor.execute(
-                "INSERT OR IGNORE INTO products (name, price, category) VALUES (?, ?, ?)",
-                (name, price, category)
-            )
-        
         # Insert orders
         orders = [
             (1, 1, 1),  # Alice buys Laptop
@@ -137,13 +131,25 @@ class SQLQueryExecutor:
             (2, 1, 1),  # Bob buys Laptop
         ]
         
-        for user_id, product_id, quantity in orders:
-            self.cursor.execute(
+        # One transaction for all three tables instead of one commit per row
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO users (name, email) VALUES (?, ?)",
+                users
+            )
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO products (name, price, category) VALUES (?, ?, ?)",
+                products
+            )
+            self.cursor.executemany(
                 "INSERT INTO orders (user_id, product_id, quantity) VALUES (?, ?, ?)",
-                (user_id, product_id, quantity)
+                orders
             )
-        
-        self.connection.commit()
+        except sqlite3.Error:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
         self.logger.info("Sample data inserted successfully")
     
     def add_query_plan(self, plan: QueryPlan) -> None:
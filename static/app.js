@@ -88,10 +88,24 @@ document.addEventListener('DOMContentLoaded', () => {
     if (logoutBtn) {
         logoutBtn.addEventListener('click', (e) => {
             e.preventDefault();
+            releaseActiveSession();
             logout();
         });
     }
 
+    // Free the active session's server-side runtime on explicit logout
+    // 主动登出时释放当前会话在服务端的运行时（内存和 MCP 连接）
+    function releaseActiveSession() {
+        if (!accessToken || !activeSessionId) return;
+        // Native fetch: a 401 here must not re-enter logout() via authFetch.
+        // keepalive lets the request complete after the redirect to the login page.
+        fetch(`/sessions/${activeSessionId}/release`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${accessToken}` },
+            keepalive: true
+        }).catch(() => {});
+    }
+
     function logout() {
         accessToken = null;
         currentUser = null;
@@ -1,6 +1,29 @@
+import io
+import os
 import sys
 import json
 import logging
+import selectors
+
+# orjson parses/encodes straight from/to bytes; fall back to the stdlib when it is missing
+try:
+    import orjson
+    loads = orjson.loads
+    dumps = orjson.dumps
+    
+    def write_json(obj, out):
+        out.write(orjson.dumps(obj))
+except ImportError:
+    loads = json.loads
+    _encoder = json.JSONEncoder(separators=(",", ":"))
+    
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+    
+    def write_json(obj, out):
+        # Stream encoder chunks into the buffered writer instead of building the full string
+        for chunk in _encoder.iterencode(obj):
+            out.write(chunk.encode())
 
 # Configure logging to stderr to avoid interfering with stdout
 logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='[Server] %(message)s')
@@ -8,124 +31,177 @@ logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='[Server] %(me
 def log(msg):
     logging.info(msg)
 
+def handle_line(line, out):
+    """Handle one JSON-RPC line and buffer its response (if any) into `out`."""
+    if not line.strip():
+        return
+    try:
+        request = loads(line)
+        log(f"Received: {line.decode(errors='replace').strip()}")
+        
+        response = handle_request(request)
+        if response is None:
+            return
+        
+        # Static responses arrive pre-encoded; dynamic ones are encoded straight into `out`
+        if isinstance(response, bytes):
+            out.write(response)
+        else:
+            write_json(response, out)
+        out.write(b"\n")
+        log(f"Sent response for id={request.get('id')}")
+            
+    except ValueError:
+        # json.JSONDecodeError and orjson.JSONDecodeError both subclass ValueError
+        log("Invalid JSON received")
+    except Exception as e:
+        log(f"Error: {e}")
+
 def main():
     log("Starting Mock MCP Server...")
     
+    # Buffered stdout: responses are flushed once per input batch instead of once per request
+    out = io.BufferedWriter(io.FileIO(sys.stdout.fileno(), "wb", closefd=False), 65536)
+    stdin_fd = sys.stdin.fileno()
+    pending = b""
+    
+    # Zero-timeout readiness probe on stdin (select() does not support pipes on Windows)
+    sel = None
+    if sys.platform != "win32":
+        sel = selectors.DefaultSelector()
+        sel.register(stdin_fd, selectors.EVENT_READ)
+    
     while True:
-        try:
-            line = sys.stdin.readline()
-            if not line:
-                break
-            
-            request = json.loads(line)
-            log(f"Received: {line.strip()}")
-            
-            response = handle_request(request)
-            if response:
-                response_str = json.dumps(response)
-                log(f"Sending: {response_str}")
-                sys.stdout.write(response_str + "\n")
-                sys.stdout.flush()
-                
-        except json.JSONDecodeError:
-            log("Invalid JSON received")
-        except Exception as e:
-            log(f"Error: {e}")
-
-def handle_request(request):
-    method = request.get("method")
-    req_id = request.get("id")
+        # os.read returns whatever is currently available, so one call drains a whole batch
+        chunk = os.read(stdin_fd, 65536)
+        if not chunk:
+            break
+        
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            handle_line(line, out)
+        
+        # More requests already queued: keep draining, responses stay buffered
+        if sel is not None and sel.select(timeout=0):
+            continue
+        
+        # Input channel drained: flush every response of this batch with a single write
+        out.flush()
     
-    # Handle Initialize
-    if method == "initialize":
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "protocolVersion": "2024-11-05",
-                "capabilities": {},
-                "serverInfo": {
-                    "name": "mock-server",
-                    "version": "1.0.0"
-                }
+    # Last line without a trailing newline
+    handle_line(pending, out)
+    out.flush()
+    if sel is not None:
+        sel.close()
+
+# Static results: serialized once at import, only the request id is spliced in per call
+INITIALIZE_RESULT = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {},
+    "serverInfo": {
+        "name": "mock-server",
+        "version": "1.0.0"
+    }
+}
+
+TOOLS_LIST_RESULT = {
+    "tools": [
+        {
+            "name": "mock_echo",
+            "description": "Echo back the input",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "message": {"type": "string"}
+                },
+                "required": ["message"]
+            }
+        },
+        {
+            "name": "mock_add",
+            "description": "Add two numbers",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "a": {"type": "number"},
+                    "b": {"type": "number"}
+                },
+                "required": ["a", "b"]
             }
         }
+    ]
+}
+
+def _result_body(result):
+    """Serialize `"result": {...}` without the surrounding braces."""
+    return dumps({"result": result}).decode()[1:-1]
+
+_INITIALIZE_BODY = _result_body(INITIALIZE_RESULT)
+_TOOLS_LIST_BODY = _result_body(TOOLS_LIST_RESULT)
+
+def _static_response(body, req_id):
+    return f'{{"jsonrpc":"2.0","id":{dumps(req_id).decode()},{body}}}'.encode()
+
+def handle_initialize(request):
+    return _static_response(_INITIALIZE_BODY, request.get("id"))
+
+def handle_initialized(request):
+    # Notifications need no response
+    return None
+
+def handle_tools_list(request):
+    return _static_response(_TOOLS_LIST_BODY, request.get("id"))
+
+def handle_tools_call(request):
+    params = request.get("params", {})
+    name = params.get("name")
+    args = params.get("arguments", {})
     
-    # Handle Notifications (no response needed)
-    if method == "notifications/initialized":
-        return None
+    content = []
+    is_error = False
     
-    # Handle Tools List
-    if method == "tools/list":
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "tools": [
-                    {
-                        "name": "mock_echo",
-                        "description": "Echo back the input",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "message": {"type": "string"}
-                            },
-                            "required": ["message"]
-                        }
-                    },
-                     {
-                        "name": "mock_add",
-                        "description": "Add two numbers",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "a": {"type": "number"},
-                                "b": {"type": "number"}
-                            },
-                            "required": ["a", "b"]
-                        }
-                    }
-                ]
-            }
-        }
-        
-    # Handle Tools Call
-    if method == "tools/call":
-        params = request.get("params", {})
-        name = params.get("name")
-        args = params.get("arguments", {})
-        
-        content = []
-        is_error = False
-        
-        if name == "mock_echo":
-            content = [{"type": "text", "text": f"Echo: {args.get('message')}"}]
-        elif name == "mock_add":
-            try:
-                a = args.get("a")
-                b = args.get("b")
-                result = a + b
-                content = [{"type": "text", "text": str(result)}]
-            except Exception:
-                content = [{"type": "text", "text": "Invalid arguments"}]
-                is_error = True
-        else:
-            content = [{"type": "text", "text": f"Unknown tool: {name}"}]
+    if name == "mock_echo":
+        content = [{"type": "text", "text": f"Echo: {args.get('message')}"}]
+    elif name == "mock_add":
+        try:
+            a = args.get("a")
+            b = args.get("b")
+            result = a + b
+            content = [{"type": "text", "text": str(result)}]
+        except Exception:
+            content = [{"type": "text", "text": "Invalid arguments"}]
             is_error = True
-            
-        return {
-            "jsonrpc": "2.0",
-            "id": req_id,
-            "result": {
-                "content": content,
-                "isError": is_error
-            }
+    else:
+        content = [{"type": "text", "text": f"Unknown tool: {name}"}]
+        is_error = True
+        
+    return {
+        "jsonrpc": "2.0",
+        "id": request.get("id"),
+        "result": {
+            "content": content,
+            "isError": is_error
         }
+    }
+
+HANDLERS = {
+    "initialize": handle_initialize,
+    "notifications/initialized": handle_initialized,
+    "tools/list": handle_tools_list,
+    "tools/call": handle_tools_call,
+}
 
+def handle_request(request):
+    """Dispatch a JSON-RPC request; returns encoded bytes, a response dict, or None."""
+    handler = HANDLERS.get(request.get("method"))
+    if handler is not None:
+        return handler(request)
+    
     # Unknown method
     return {
         "jsonrpc": "2.0",
-        "id": req_id,
+        "id": request.get("id"),
         "error": {"code": -32601, "message": "Method not found"}
     }
 
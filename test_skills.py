@@ -24,8 +24,9 @@ print("\n" + "=" * 50)
 print("Test 2: SkillsManager")
 print("=" * 50)
 
-manager = SkillsManager(skills_root)
-manager.load_skills()
+# 复用测试 1 已加载的元信息，避免再次扫描 .skills/ 目录
+manager = SkillsManager(skills_root, preloaded_metadata=metadata_list)
+print(f"Manager holds {manager.get_skill_count()} skills")
 
 # 测试搜索
 print("\nSearch for 'uint':")
@@ -1,19 +1,35 @@
 import sys
 import os
+import asyncio
+import io
 import unittest
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi.testclient import TestClient
+import httpx
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from server import app
 from auth import models, database, security
+from passlib.context import CryptContext
 import shutil
 
+# Minimum bcrypt cost for tests: hashes still verify, but each hash/verify is ~256x cheaper
+security.pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+# 1x1 PNG used for avatar uploads, served from memory
+_PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\nIDATx\x9cc\x00\x01\x00\x00\x05\x00\x01\r\n-\xb4\x00\x00\x00\x00IEND\xaeB`\x82"
+
 # Setup Test Database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test_settings.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# In-memory SQLite; StaticPool hands the same connection to every thread
+# (FastAPI runs sync endpoints in a worker thread), so the data stays visible.
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def override_get_db():
@@ -23,14 +39,26 @@ def override_get_db():
     finally:
         db.close()
 
-app.dependency_overrides[database.get_db] = override_get_db
+def make_client():
+    # In-process ASGI client: no server, no per-request thread hop like TestClient
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://testserver")
 
-client = TestClient(app)
+async def fetch_admin_token():
+    async with make_client() as client:
+        response = await client.post(
+            "/auth/token",
+            data={"username": "admin", "password": "admin123"}
+        )
+        return response.json()["access_token"]
 
-class TestSettingsAndProfile(unittest.TestCase):
+class TestSettingsAndProfile(unittest.IsolatedAsyncioTestCase):
     @classmethod
     def setUpClass(cls):
-        models.Base.metadata.create_all(bind=engine)
+        # Route handlers captured Depends(database.get_db) at import time, so the
+        # override has to go through FastAPI; scope it to this test class only.
+        app.dependency_overrides[database.get_db] = override_get_db
+        with engine.begin() as conn:
+            models.Base.metadata.create_all(conn)
         # Create Admin
         db = TestingSessionLocal()
         if not db.query(models.User).filter(models.User.username == "admin").first():
@@ -42,34 +70,34 @@ class TestSettingsAndProfile(unittest.TestCase):
             db.add(admin)
             db.commit()
         db.close()
+        # Log in once; bcrypt verification is slow and no test changes the admin password
+        cls._admin_token = asyncio.run(fetch_admin_token())
 
     @classmethod
     def tearDownClass(cls):
-        # Retrieve userimages to cleanup
-        if os.path.exists("test_settings.db"):
-            os.remove("test_settings.db")
-        if os.path.exists("test_image.png"):
-             os.remove("test_image.png")
+        app.dependency_overrides.pop(database.get_db, None)
+
+    async def asyncSetUp(self):
+        self.client = make_client()
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
 
     def get_admin_token(self):
-        response = client.post(
-            "/auth/token",
-            data={"username": "admin", "password": "admin123"}
-        )
-        return response.json()["access_token"]
+        return self._admin_token
 
-    def test_01_get_settings_public(self):
+    async def test_01_get_settings_public(self):
         # Public endpoint
-        response = client.get("/auth/settings")
+        response = await self.client.get("/auth/settings")
         self.assertEqual(response.status_code, 200)
         self.assertIsInstance(response.json(), list)
 
-    def test_02_update_settings_admin(self):
+    async def test_02_update_settings_admin(self):
         token = self.get_admin_token()
         headers = {"Authorization": f"Bearer {token}"}
         
         # 1. Update Site Name
-        response = client.put(
+        response = await self.client.put(
             "/auth/settings",
             headers=headers,
             json={"key": "site_name", "value": "Test Agent"}
@@ -78,27 +106,27 @@ class TestSettingsAndProfile(unittest.TestCase):
         self.assertEqual(response.json()["value"], "Test Agent")
         
         # 2. Verify Get
-        response = client.get("/auth/settings")
+        response = await self.client.get("/auth/settings")
         settings = response.json()
         site_name = next((s for s in settings if s["key"] == "site_name"), None)
         self.assertIsNotNone(site_name)
         self.assertEqual(site_name["value"], "Test Agent")
 
-    def test_03_avatar_upload_and_update_profile(self):
+    async def test_03_avatar_upload_and_update_profile(self):
         token = self.get_admin_token()
         headers = {"Authorization": f"Bearer {token}"}
         
-        # 1. Create a dummy image
-        with open("test_image.png", "wb") as f:
-            f.write(b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\nIDATx\x9cc\x00\x01\x00\x00\x05\x00\x01\r\n-\xb4\x00\x00\x00\x00IEND\xaeB`\x82")
+        # 1. Dummy image straight from memory
+        buf = io.BytesIO(_PNG)
             
         # 2. Upload
-        with open("test_image.png", "rb") as f:
-            response = client.post(
-                "/auth/upload/avatar",
-                headers=headers,
-                files={"file": ("test_image.png", f, "image/png")}
-            )
+        # Kept sequential: both endpoints are sync and would run in parallel
+        # threadpool threads on the single StaticPool SQLite connection
+        response = await self.client.post(
+            "/auth/upload/avatar",
+            headers=headers,
+            files={"file": ("test_image.png", buf, "image/png")}
+        )
         
         self.assertEqual(response.status_code, 200)
         data = response.json()
@@ -108,10 +136,10 @@ class TestSettingsAndProfile(unittest.TestCase):
         
         # 3. Update User Profile with new Avatar
         # Get Admin ID first
-        user_resp = client.get("/auth/users/me", headers=headers)
+        user_resp = await self.client.get("/auth/users/me", headers=headers)
         user_id = user_resp.json()["id"]
         
-        response = client.put(
+        response = await self.client.put(
             f"/auth/users/{user_id}",
             headers=headers,
             json={"avatar_url": avatar_url}
@@ -120,7 +148,7 @@ class TestSettingsAndProfile(unittest.TestCase):
         self.assertEqual(response.json()["avatar_url"], avatar_url)
         
         # 4. Verify in Me
-        response = client.get("/auth/users/me", headers=headers)
+        response = await self.client.get("/auth/users/me", headers=headers)
         self.assertEqual(response.json()["avatar_url"], avatar_url)
 
 if __name__ == "__main__":
@@ -1,7 +1,21 @@
-import urllib.request
-import urllib.parse
+import asyncio
+import base64
 import json
+import os
 import random
+import time
+from pathlib import Path
+
+import httpx
+
+# orjson encodes/parses straight to/from bytes; fall back to the stdlib when it is missing
+try:
+    from orjson import dumps, loads
+except ImportError:
+    from json import loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
 
 BASE_URL = "http://localhost:8000"
 ADMIN_USER = "admin"
@@ -11,113 +25,195 @@ TEST_USER_BASE = "test_reg_user"
 TEST_PASS = "pass123"
 NEW_PASS = "newpass123"
 
-def make_request(url, method='GET', data=None, token=None):
-    headers = {}
+# Admin token cache shared across runs, keyed by (BASE_URL, user)
+TOKEN_CACHE_FILE = Path.home() / ".cache" / "ownAgent" / "admin_token.json"
+TOKEN_EXPIRY_MARGIN = 60  # seconds
+
+# Fixed request bodies, encoded once
+REGISTRATION_BODIES = {
+    allow: dumps({"key": "allow_registration", "value": str(allow).lower()})
+    for allow in (True, False)
+}
+
+# Header dicts for the token-less cases, built once (httpx copies them, never mutates)
+ANON_HEADERS = {}
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+async def make_request(client, path, method='GET', data=None, token=None, body=None):
+    # `body` is an already-encoded JSON payload; `data` is encoded here
+    if body is None and data is not None:
+        body = dumps(data)
+
     if token:
-        headers['Authorization'] = f"Bearer {token}"
-    
-    if data:
-        headers['Content-Type'] = 'application/json'
-        data_encoded = json.dumps(data).encode('utf-8')
+        headers = {'Authorization': f"Bearer {token}"}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
     else:
-        data_encoded = None
+        headers = JSON_HEADERS if body is not None else ANON_HEADERS
 
-    req = urllib.request.Request(url, data=data_encoded, headers=headers, method=method)
-    
     try:
-        with urllib.request.urlopen(req) as response:
-            resp_body = response.read().decode()
-            try:
-                return response.status, json.loads(resp_body)
-            except:
-                return response.status, resp_body
-    except urllib.error.HTTPError as e:
-        return e.code, e.read().decode()
-    except Exception as e:
+        response = await client.request(method, path, content=body, headers=headers)
+    except httpx.HTTPError as e:
         print(f"Request error: {e}")
         return 500, str(e)
 
-def login(username, password):
+    # Decide by Content-Type instead of trying to parse and catching the failure
+    if response.headers.get('Content-Type', '').startswith('application/json'):
+        return response.status_code, loads(response.content)
+    return response.status_code, response.text
+
+async def login(client, username, password):
     # Form data for login
-    url = f"{BASE_URL}/auth/token"
-    data = {"username": username, "password": password}
-    data_encoded = urllib.parse.urlencode(data).encode()
-    req = urllib.request.Request(url, data=data_encoded, method='POST')
-    
     try:
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            return result.get("access_token")
+        response = await client.post("/auth/token", data={"username": username, "password": password})
+        response.raise_for_status()
+        return loads(response.content).get("access_token")
     except Exception as e:
         print(f"Login failed: {e}")
         return None
 
-def set_registration(token, allow):
-    return make_request(f"{BASE_URL}/auth/settings", 'PUT', {"key": "allow_registration", "value": str(allow).lower()}, token)
-
-def register_user(username, password):
-    return make_request(f"{BASE_URL}/auth/register", 'POST', {"username": username, "password": password})
-
-def change_password(token, old_pass, new_pass):
-    return make_request(f"{BASE_URL}/auth/users/me/password", 'PUT', {"current_password": old_pass, "new_password": new_pass}, token)
-
-def main():
-    print("Logging in as admin...")
-    admin_token = login(ADMIN_USER, ADMIN_PASS)
-    if not admin_token:
-        print("Failed to login as admin. Ensure server is running.")
-        return
-
-    print("Disabling registration...")
-    status, _ = set_registration(admin_token, False)
-    if status != 200:
-        print(f"Failed to set registration: {status}")
-        return
+def _token_exp(token):
+    # Only the `exp` claim of the JWT payload is read; the signature is the server's business
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+    except (IndexError, ValueError):
+        return None
 
-    print("Attempting to register (expect failure)...")
-    status, _ = register_user("should_fail_user", "pass")
-    if status == 403:
-        print("Success: Registration blocked as expected.")
-    else:
-        print(f"Failure: Registration not blocked (Status: {status})")
-
-    print("Enabling registration...")
-    status, _ = set_registration(admin_token, True)
-    if status != 200:
-        print(f"Failed to set registration: {status}")
-        return
-
-    print("Attempting to register (expect success)...")
-    suffix = random.randint(1000, 9999)
-    user = f"{TEST_USER_BASE}_{suffix}"
-    
-    status, _ = register_user(user, TEST_PASS)
-    if status == 200:
-        print(f"Success: Registered {user}.")
-    else:
-        print(f"Failure: Registration failed (Status: {status})")
-        return
-
-    print("Logging in as new user...")
-    user_token = login(user, TEST_PASS)
-    if not user_token:
-        print("Failed to login as new user")
-        return
-    
-    print("Changing password...")
-    status, _ = change_password(user_token, TEST_PASS, NEW_PASS)
-    if status == 200:
-        print(f"Success: Password changed to {NEW_PASS}.")
-    else:
-        print(f"Failure: Password change failed ({status})")
-        return
+def _load_token_cache():
+    try:
+        return json.loads(TOKEN_CACHE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
 
-    print("Verifying new password login...")
-    new_token = login(user, NEW_PASS)
-    if new_token:
-        print("Success: Login with new password works.")
-    else:
-        print("Failure: Login with new password failed.")
+def _save_token_cache(cache):
+    # The file holds a bearer token: owner-only directory and file permissions
+    try:
+        TOKEN_CACHE_FILE.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd = os.open(TOKEN_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            # The mode above only applies on creation; tighten files left by older runs
+            os.chmod(TOKEN_CACHE_FILE, 0o600)
+            f.write(json.dumps(cache))
+    except OSError as e:
+        print(f"Could not write token cache: {e}")
+
+async def get_cached_token(client, username, password, refresh=False):
+    """login() with a file cache; a fresh login happens only on miss, near expiry or refresh=True."""
+    key = f"{BASE_URL}|{username}"
+    cache = _load_token_cache()
+    entry = cache.get(key)
+    if not refresh and entry and entry.get("exp") and entry["exp"] - TOKEN_EXPIRY_MARGIN > time.time():
+        return entry["token"]
+
+    token = await login(client, username, password)
+    if token:
+        exp = _token_exp(token)
+        if exp:
+            cache[key] = {"token": token, "exp": exp}
+            _save_token_cache(cache)
+    return token
+
+async def set_registration(client, token, allow):
+    return await make_request(client, "/auth/settings", 'PUT', token=token, body=REGISTRATION_BODIES[allow])
+
+async def register_user(client, username, password):
+    return await make_request(client, "/auth/register", 'POST', {"username": username, "password": password})
+
+async def get_settings(client):
+    return await make_request(client, "/auth/settings")
+
+async def get_user_me(client, token):
+    return await make_request(client, "/auth/users/me", token=token)
+
+async def change_password(client, token, old_pass, new_pass):
+    return await make_request(client, "/auth/users/me/password", 'PUT', {"current_password": old_pass, "new_password": new_pass}, token)
+
+async def main():
+    # One client for the whole run: every step reuses the same keep-alive connection
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=10.0) as client:
+        print("Logging in as admin...")
+        admin_token = await get_cached_token(client, ADMIN_USER, ADMIN_PASS)
+        if not admin_token:
+            print("Failed to login as admin. Ensure server is running.")
+            return
+
+        print("Disabling registration...")
+        status, _ = await set_registration(client, admin_token, False)
+        if status == 401:
+            # Cached token rejected (e.g. server secret rotated): log in again once
+            admin_token = await get_cached_token(client, ADMIN_USER, ADMIN_PASS, refresh=True)
+            if not admin_token:
+                print("Failed to login as admin. Ensure server is running.")
+                return
+            status, _ = await set_registration(client, admin_token, False)
+        if status != 200:
+            print(f"Failed to set registration: {status}")
+            return
+
+        print("Attempting to register (expect failure)...")
+        status, _ = await register_user(client, "should_fail_user", "pass")
+        if status == 403:
+            print("Success: Registration blocked as expected.")
+        else:
+            print(f"Failure: Registration not blocked (Status: {status})")
+
+        print("Enabling registration...")
+        status, _ = await set_registration(client, admin_token, True)
+        if status != 200:
+            print(f"Failed to set registration: {status}")
+            return
+
+        print("Attempting to register (expect success)...")
+        suffix = random.randint(1000, 9999)
+        user = f"{TEST_USER_BASE}_{suffix}"
+
+        status, _ = await register_user(client, user, TEST_PASS)
+        if status == 200:
+            print(f"Success: Registered {user}.")
+        else:
+            print(f"Failure: Registration failed (Status: {status})")
+            return
+
+        print("Logging in as new user...")
+        user_token = await login(client, user, TEST_PASS)
+        if not user_token:
+            print("Failed to login as new user")
+            return
+
+        print("Changing password...")
+        status, _ = await change_password(client, user_token, TEST_PASS, NEW_PASS)
+        if status == 200:
+            print(f"Success: Password changed to {NEW_PASS}.")
+        else:
+            print(f"Failure: Password change failed ({status})")
+            return
+
+        # Independent read-only follow-up probes: fire them concurrently
+        print("Verifying new password login, registration setting and profile...")
+        new_token, (settings_status, settings), (me_status, me) = await asyncio.gather(
+            login(client, user, NEW_PASS),
+            get_settings(client),
+            get_user_me(client, user_token),
+        )
+        if new_token:
+            print("Success: Login with new password works.")
+        else:
+            print("Failure: Login with new password failed.")
+
+        allow = None
+        if settings_status == 200:
+            allow = next((s["value"] for s in settings if s["key"] == "allow_registration"), None)
+        if allow == "true":
+            print("Success: Registration is still enabled.")
+        else:
+            print(f"Failure: Unexpected allow_registration setting ({settings_status}, {allow})")
+
+        if me_status == 200 and me.get("username") == user:
+            print(f"Success: Profile of {user} is readable.")
+        else:
+            print(f"Failure: Could not read profile ({me_status})")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
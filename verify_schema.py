@@ -12,8 +12,10 @@ executor = ToolExecutor()
 executor.register(list_files, ListFilesArgs)
 
 definitions = executor.get_definitions()
+# Index definitions by tool name once, then look tools up directly
+defs_by_name = {d['function']['name']: d for d in definitions}
 # Check list_files schema
-tool_def = next((d for d in definitions if d['function']['name'] == 'list_files'), None)
+tool_def = defs_by_name.get('list_files')
 
 if tool_def:
     print(f"Tool: {tool_def['function']['name']}")